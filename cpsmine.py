@@ -8,16 +8,22 @@ Modified for python3 by David Couture.
 
 
 from argparse import ArgumentDefaultsHelpFormatter, ArgumentParser, SUPPRESS
+from array import array
+from calendar import monthrange, timegm
+from collections import Counter
 import csv
-from datetime import datetime, timedelta
-import statistics
+from datetime import datetime, timezone
+from math import sqrt
+import re
 import sys
 
 
 FMT = "%Y/%m/%d %H:%M:%S"
-COMPRESSED_TS = "%Y%m%d%H%M%S"
+START_TIME_RE = re.compile(r'\d{4}/\d{2}/\d{2} \d{2}:\d{2}:\d{2}', re.ASCII)
+PRINT_FMT = "%Y-%m-%d %H:%M:%S"
 
 PROTO_LIST = ('icmp', 'tcp', 'udp')
+PROTO_SET = frozenset(PROTO_LIST)
 
 
 def add_group_args(group):
@@ -85,110 +91,117 @@ def add_optional_args(parser):
         help='Suppress logging for every epoch interval.')
 
 
-def cli_parseargs():
-    '''cli_parseargs'''
+def bucket_cpsdict(cpsdict, interval, ordered):
+    '''bucket_cpsdict
 
-    parser = ArgumentParser(
-        formatter_class=ArgumentDefaultsHelpFormatter,
-        description='Script to extract cps information for the firewall.')
-
-    # Add the optional arguments.
-
-    add_optional_args(parser)
-
-    # Add the group of mutually exclusive arguments.
-
-    group = parser.add_mutually_exclusive_group(required=True)
-    add_group_args(group)
-
-    return parser.parse_args()
-
-
-def evaluate_cpsdict(cpsdict, cli_vars):
-    '''evaluate_cpsdict
-
-    Loop over the count per second dictionary looking for
-    timestamps|counts that should be added to count per second list.
+    Walk the count per second dictionary in timestamp order and
+    yield a (timestamp, count) tuple for every run of timestamps
+    that fall within 1/2 of the interval of each other. Timestamps
+    are epoch seconds so the deltas are plain integer subtraction.
 
     '''
-    if not cpsdict:
-        return
-
-    # Use interval as a timedelta for easy comparison.
-
-    interval = timedelta(seconds=cli_vars['interval'])
 
-    sorted_keys = sorted(cpsdict)
+    # Log files are normally already in time order in which case the
+    # dictionary's insertion order can be used as is.
 
-    # Set initial values using the first sorted key.
+    items = iter(cpsdict.items() if ordered else sorted(cpsdict.items()))
 
-    previous_key = sorted_keys[0]
-    previous_ts = datetime.strptime(previous_key, COMPRESSED_TS)
+    half_interval = interval/2
 
-    count = cpsdict[previous_key]
+    # Set initial values using the first sorted item.
 
-    cpslist = []
+    previous_ts, count = next(items)
 
-    # Loop over the remaining sorted keys starting from the second key.
+    # Loop over the remaining sorted items starting from the second one.
 
-    for key in sorted_keys[1:]:
-
-        ts = datetime.strptime(key, COMPRESSED_TS)
+    for ts, ts_count in items:
 
         # Check if the time delta between the two timestamps
         # is smaller than 1/2 of the interval.
 
-        if (ts - previous_ts) <= interval/2:
+        if (ts - previous_ts) <= half_interval:
             count += 1
             continue
 
-        # Check if this row should be added to cpslist.
-
-        evaluate_row(cpslist, count, previous_ts, cli_vars)
+        yield previous_ts, count
 
         # Reset values for the next iteration.
 
-        previous_key = key
         previous_ts = ts
-        count = cpsdict[key]
+        count = ts_count
 
-    # There may be an active count that didn't get evaluated
-    # before EOF so call evaluate_row() just to be sure.
+    # There may be an active count that didn't get yielded
+    # before the last key so yield it as well.
 
-    evaluate_row(cpslist, count, previous_ts, cli_vars)
+    yield previous_ts, count
 
-    return cpslist
 
+def cli_parseargs():
+    '''cli_parseargs'''
 
-def evaluate_row(cpslist, count, ts, cli_vars):
-    '''evaluate_row
+    parser = ArgumentParser(
+        formatter_class=ArgumentDefaultsHelpFormatter,
+        description='Script to extract cps information for the firewall.')
+
+    # Add the optional arguments.
 
-    Determine if row should be added to cpslist.
+    add_optional_args(parser)
+
+    # Add the group of mutually exclusive arguments.
+
+    group = parser.add_mutually_exclusive_group(required=True)
+    add_group_args(group)
+
+    return parser.parse_args()
+
+
+def evaluate_cpsdict(cpsdict, ordered, cli_vars):
+    '''evaluate_cpsdict
+
+    Loop over the bucketed count per second dictionary looking for
+    timestamps|counts that should be added to count per second list.
 
     '''
-    if ts is None:
+    if not cpsdict:
         return
 
+    # These don't change between buckets so only look them up once.
+
     highcps = cli_vars['highcps']
     interval = cli_vars['interval']
     lowcps = cli_vars['lowcps']
     suppress = (cli_vars['suppress'] == 'true')
 
-    highlight = ''
+    # There can't be more buckets than keys so allocate a contiguous
+    # array of doubles up front and trim it to size at the end.
 
-    cps = count/interval
+    cpslist = array('d', [0.0]) * len(cpsdict)
+    n = 0
 
-    if count > 1:
-        if cps > lowcps and cps < highcps:
+    for ts, count in bucket_cpsdict(cpsdict, interval, ordered):
+
+        highlight = ''
+
+        cps = count/interval
+
+        # Check if this bucket should be added to cpslist.
+
+        if count > 1 and lowcps < cps < highcps:
 
             # Add entry to cpslist array and set the highlight for
             # when it's printed.
 
-            cpslist.append(cps)
+            cpslist[n] = cps
+            n += 1
             highlight = '** '
 
-    if not suppress:
-        print(f'{highlight}{ts} cps is {cps}')
+        if not suppress:
+            ts = datetime.fromtimestamp(ts, timezone.utc)
+            print(f'{highlight}{ts.strftime(PRINT_FMT)} cps is {cps}')
+
+    del cpslist[n:]
+
+    return cpslist
 
 
 def main():
@@ -206,11 +219,11 @@ def main():
 
     try:
         with open(fname, newline='') as csvfile:
-            reader = csv.DictReader(csvfile)
+            reader = csv.reader(csvfile)
 
-            cpsdict = process_csvfile(reader, cli_vars)
+            cpsdict, ordered = process_csvfile(reader, cli_vars)
 
-            cpslist = evaluate_cpsdict(cpsdict, cli_vars)
+            cpslist = evaluate_cpsdict(cpsdict, ordered, cli_vars)
 
             print_results(cpslist, cli_vars)
 
@@ -264,14 +277,14 @@ def print_stats(cpslist, header):
         sys.exit('ERROR: Need a least two data points to calculate '
                  'standard deviation.')
 
-    mean = statistics.mean(cpslist)
-    stdev = statistics.stdev(cpslist)
+    mean, stdev = welford(cpslist)
+    peak = max(cpslist)
 
-    print(f'Max cps for {header} is= {max(cpslist):.0f}')
+    print(f'Max cps for {header} is= {peak:.0f}')
     print(f'Avg cps for {header} is= {mean:.3f}\n')
     print(f'Standard Deviation for {header} is= {stdev:.3f}\n')
 
-    print_thresholds(max(cpslist), mean, stdev)
+    print_thresholds(peak, mean, stdev)
 
 
 def print_thresholds(peak, mean, stdev):
@@ -293,81 +306,179 @@ def process_csvfile(reader, cli_vars):
     Loop over the whole CVS file a filter out matching lines and add
     those the the count per second dictionary (cpsdict).
 
+    Returns cpsdict and whether its keys are already in time order.
+
     '''
+    IP_PROTO = 'IP Protocol'
     START_TIME = 'Start Time'
 
     # Required values either set by user or by defaults.
 
     fname = cli_vars['filename']
     interface = cli_vars['interface']
-    interval = cli_vars['interval']
     proto = cli_vars['protocol']
     zone = cli_vars['zone']
 
-    cpsdict = {}
+    # Set row_key and target depending on whether we are searching for
+    # an interface or a zone.
 
-    try:
+    if interface:
+        row_key = 'Inbound Interface'
+        target = interface
+    else:
+        row_key = 'Source Zone'
+        target = zone
 
-        for row in reader:
+    # The protocol filter never changes between rows so decide once
+    # which check to apply rather than re-evaluating it for every row.
+    # 'all' needs no check at all.
 
-            if skip_row(row, interface, proto, zone):
-                continue
+    if proto == 'all':
+        proto_ok = None
+    elif proto == 'other':
+        def proto_ok(row_proto):
+            return row_proto not in PROTO_SET
+    else:
+        def proto_ok(row_proto):
+            return row_proto == proto
+
+    try:
+
+        # Only a few columns are needed so look up their positions in
+        # the header once and index plain row lists by position. The
+        # protocol column is only needed when filtering on protocol.
 
-            ts = datetime.strptime(row[START_TIME], FMT)
+        header = next(reader, None)
 
-            compressed_ts = ts.strftime(COMPRESSED_TS)
+        if header is None:
+            return Counter(), True
 
-            # If there is already an key for compressed_ts then add one
-            # to its count otherwise create a new key entry.
+        try:
+            key_idx = header.index(row_key)
+            start_idx = header.index(START_TIME)
 
-            if cpsdict.get(compressed_ts):
-                cpsdict[compressed_ts] += 1
+            if proto_ok is None:
+                width = max(key_idx, start_idx) + 1
             else:
-                cpsdict[compressed_ts] = 1
+                proto_idx = header.index(IP_PROTO)
+                width = max(key_idx, start_idx, proto_idx) + 1
+
+        except ValueError as errmsg:
+            sys.exit('ERROR: file: {}; {}'.format(fname, errmsg))
+
+        # Unlike DictReader, csv.reader yields [] for blank lines and a
+        # short list for truncated rows, so drop any row that is too
+        # short to hold the columns in use rather than index past it.
+
+        # Count the start time of every matching row; Counter does the
+        # counting in C rather than with a get/set per row. Don't even
+        # look at the proto if the target doesn't match. Filtering and
+        # counting happen in this single pass so, apart from the list
+        # csv.reader yields for each row, no per-row dict is built and
+        # no list of matching rows is collected.
+
+        if proto_ok is None:
+            start_times = Counter(
+                row[start_idx] for row in reader
+                if len(row) >= width and row[key_idx] == target)
+        else:
+            start_times = Counter(
+                row[start_idx] for row in reader
+                if len(row) >= width and row[key_idx] == target
+                and proto_ok(row[proto_idx]))
 
     except csv.Error as errmsg:
         sys.exit('ERROR: file: {}, line: {}; {}'.format(
             fname, reader.line_num, errmsg))
 
-    return cpsdict
+    # Many rows share the same start time so only convert each
+    # distinct timestamp once instead of once per row. Start times in
+    # FMT's zero padded form are sliced into fields and turned into
+    # epoch seconds without going through strptime(). Consecutive
+    # timestamps nearly always fall on the same day so only call
+    # timegm() when the date changes and add the time of day to that
+    # midnight.
 
+    cpsdict = Counter()
 
-def skip_row(row, interface, proto, zone):
-    '''skip_row
+    ordered = True
+    previous_ts = None
+    date = None
 
-    Returns True if row should be skipped.
+    try:
 
-    Returns False if row should NOT be skipped.
+        for start_time, count in start_times.items():
 
-    '''
+            ts = None
 
-    IP_PROTO = 'IP Protocol'
+            # timegm() and the arithmetic below silently roll over out
+            # of range fields (2019/02/30 becomes March 2nd) so the
+            # fast path only takes ASCII digits in FMT's exact layout
+            # and in the ranges datetime.strptime(FMT) accepts.
 
-    # Set row_key and target depending on whether we are searching for
-    # an interface or a zone.
+            if START_TIME_RE.fullmatch(start_time):
 
-    if interface:
-        row_key = 'Inbound Interface'
-        target = interface
-    else:
-        row_key = 'Source Zone'
-        target = zone
+                if start_time[0:10] != date:
+                    year = int(start_time[0:4])
+                    month = int(start_time[5:7])
+                    day = int(start_time[8:10])
 
-    # Don't even look at the proto if the target doesn't match.
+                    if (year >= 1 and 1 <= month <= 12
+                            and 1 <= day <= monthrange(year, month)[1]):
+                        date = start_time[0:10]
+                        midnight = timegm((year, month, day, 0, 0, 0))
 
-    if row[row_key] != target:
-        return True
+                hour = int(start_time[11:13])
+                minute = int(start_time[14:16])
+                second = int(start_time[17:19])
 
-    if proto == 'all':
-        return False
+                if (start_time[0:10] == date
+                        and hour <= 23 and minute <= 59 and second <= 59):
+                    ts = midnight + hour * 3600 + minute * 60 + second
+
+            # Anything else, including the unpadded forms FMT also
+            # matches, is left to strptime() to parse or reject.
 
-    if proto == 'other' and row[IP_PROTO] not in PROTO_LIST:
-        return False
+            if ts is None:
+                ts = timegm(datetime.strptime(start_time, FMT).timetuple())
+
+            cpsdict[ts] += count
+
+            # Note if the timestamps ever go backwards so the caller
+            # knows whether cpsdict still needs to be sorted.
+
+            if ordered and previous_ts is not None and ts < previous_ts:
+                ordered = False
+
+            previous_ts = ts
+
+    except ValueError as errmsg:
+        sys.exit('ERROR: file: {}; {}'.format(fname, errmsg))
+
+    return cpsdict, ordered
+
+
+def welford(values):
+    '''welford
+
+    Calculate the mean and sample standard deviation of values in a
+    single pass using Welford's algorithm, which also avoids the loss
+    of precision of the naive sum of squares.
+
+    Returns a (mean, stdev) tuple.
+
+    '''
+    n = 0
+    mean = 0.0
+    m2 = 0.0
 
-    if proto == row[IP_PROTO]:
-        return False
+    for x in values:
+        n += 1
+        delta = x - mean
+        mean += delta/n
+        m2 += delta * (x - mean)
 
-    return True
+    return mean, sqrt(m2/(n - 1))
 
 
 if __name__ == "__main__":